@@ -0,0 +1,373 @@
+import codecs
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+# Style used for annotations that come from datasets without our own attributes
+DEFAULT_SIZE = 30
+DEFAULT_COLOR = "#FF3333"
+DEFAULT_ARROW_TH = 10
+DEFAULT_ARROW_LENGTH = 130
+
+CHUNK_SIZE = 1 << 20
+# Largest single JSON value (one image, annotation, ...) we are willing to buffer
+MAX_VALUE_SIZE = 64 << 20
+
+
+# A record is a plain dict describing one annotation in image pixel coordinates:
+#   text, x, y            label anchor (Annotation.current_coords)
+#   end_x, end_y          arrow tip (Annotation.arrow_endpoint)
+#   size, color, arrow_th, arrow_length
+#   box_w, box_h          size of the source bounding box, centred on the arrow tip
+def make_record(text, x, y, end_x, end_y, size=DEFAULT_SIZE, color=DEFAULT_COLOR,
+                arrow_th=DEFAULT_ARROW_TH, arrow_length=DEFAULT_ARROW_LENGTH, box_w=0, box_h=0):
+    return {"text": text, "x": x, "y": y, "end_x": end_x, "end_y": end_y,
+            "size": size, "color": color, "arrow_th": arrow_th, "arrow_length": arrow_length,
+            "box_w": box_w, "box_h": box_h}
+
+
+@contextlib.contextmanager
+def replace_on_success(path):
+    """Yield a temporary path next to path and move it over path only if the block succeeds.
+
+    A failed write never leaves a truncated file, and the old file can still be
+    read while its replacement is being written.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix="." + name + ".", suffix=os.path.splitext(name)[1], dir=directory)
+    os.close(fd)
+    try:
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class _JsonStream:
+    """Reads JSON values one at a time from a binary file, tracking byte offsets."""
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE, max_value_size=MAX_VALUE_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.byte_pos = 0  # File offset of self.buf[self.pos]
+        self.eof = False
+
+    def _fill(self, grow=False):
+        """Append the next chunk; with grow, at least double the unread part of the buffer."""
+        if self.eof:
+            return False
+        size = max(self.chunk_size, len(self.buf) - self.pos) if grow else self.chunk_size
+        chunk = self.fp.read(size)
+        self.buf = self.buf[self.pos:] + self.decoder.decode(chunk, final=not chunk)
+        self.pos = 0
+        self.eof = not chunk
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character ('' at end of file)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+                self.byte_pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expected %r at byte %d, found %r" % (chars, self.byte_pos, char))
+        self.pos += 1
+        self.byte_pos += 1
+        return char
+
+    def _file_offset(self, index):
+        return self.byte_pos + len(self.buf[self.pos:index].encode("utf-8"))
+
+    def value(self):
+        """Decode the next value and return (value, start_byte, end_byte).
+
+        An incomplete value is retried with a buffer at least twice as large, so a
+        large value costs linear time; values over max_value_size are rejected.
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # Only errors near the end of the buffer (a cut literal or an open string)
+                # can be fixed by reading more; anything else is reported straight away
+                truncated = e.pos >= len(self.buf) - 16 or e.msg.startswith("Unterminated string")
+                if not truncated or not self._grow():
+                    raise ValueError("Invalid JSON at byte %d: %s" % (self._file_offset(e.pos), e.msg))
+                continue
+            # A number cut at the chunk boundary still decodes, so make sure it really ended
+            if end == len(self.buf) and self._grow():
+                continue
+            start = self.byte_pos
+            self.byte_pos += len(self.buf[self.pos:end].encode("utf-8"))
+            self.pos = end
+            return obj, start, self.byte_pos
+
+    def _grow(self):
+        if len(self.buf) - self.pos > self.max_value_size:
+            raise ValueError("JSON value at byte %d is larger than %d bytes" % (self.byte_pos, self.max_value_size))
+        return self._fill(grow=True)
+
+
+def iter_json_arrays(fp, chunk_size=CHUNK_SIZE, max_value_size=MAX_VALUE_SIZE):
+    """Yield (key, item, start, end) for every element of the top-level arrays of a JSON object.
+
+    Only one element is decoded at a time, so files far larger than memory can be scanned.
+    Non-array top-level values are yielded once with start/end spanning the whole value.
+    """
+    stream = _JsonStream(fp, chunk_size, max_value_size)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key, _, _ = stream.value()
+        stream.expect(":")
+        if stream.peek() == "[":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.expect("]")
+            else:
+                while True:
+                    item, start, end = stream.value()
+                    yield key, item, start, end
+                    if stream.expect(",]") == "]":
+                        break
+        else:
+            item, start, end = stream.value()
+            yield key, item, start, end
+        if stream.expect(",}") == "}":
+            return
+
+
+class CocoDataset:
+    """Index over a COCO JSON file; annotations are only decoded per image on request."""
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, max_value_size=MAX_VALUE_SIZE):
+        self.path = path
+        self.images = {}  # file_name -> {"id", "width", "height"}
+        self.categories = {}  # category id -> name
+        self._spans = {}  # image id -> [(start, end)] byte ranges of its annotations
+        with open(path, "rb") as fp:
+            for key, item, start, end in iter_json_arrays(fp, chunk_size, max_value_size):
+                if key == "annotations":
+                    self._spans.setdefault(item["image_id"], []).append((start, end))
+                elif key == "images":
+                    self.images[os.path.basename(item["file_name"])] = {
+                        "id": item["id"], "width": item.get("width"), "height": item.get("height")}
+                elif key == "categories":
+                    self.categories[item["id"]] = item["name"]
+
+    def __contains__(self, file_name):
+        return os.path.basename(file_name) in self.images
+
+    def annotations_for(self, file_name):
+        """Return the records of one image, reading only that image's annotations from disk."""
+        image = self.images.get(os.path.basename(file_name))
+        if image is None:
+            return []
+        records = []
+        with open(self.path, "rb") as fp:
+            for start, end in self._spans.get(image["id"], []):
+                fp.seek(start)
+                record = self._to_record(json.loads(fp.read(end - start)))
+                if record is not None:
+                    records.append(record)
+        return records
+
+    def _to_record(self, ann):
+        """Map one COCO annotation to a record, or None if it has no usable bbox."""
+        try:
+            x, y, w, h = (float(v) for v in ann["bbox"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        end_x, end_y = x + w / 2, y + h / 2
+        attrs = ann.get("attributes")
+        if not isinstance(attrs, dict):
+            attrs = {}
+        text = attrs.get("text", self.categories.get(ann.get("category_id"), str(ann.get("category_id"))))
+        return make_record(text, attrs.get("label_x", end_x), attrs.get("label_y", end_y), end_x, end_y,
+                           attrs.get("size", DEFAULT_SIZE), attrs.get("color", DEFAULT_COLOR),
+                           attrs.get("arrow_th", DEFAULT_ARROW_TH), attrs.get("arrow_length", DEFAULT_ARROW_LENGTH),
+                           w, h)
+
+    def iter_images(self):
+        """Yield (file_name, width, height, records) for every image, one image at a time."""
+        for file_name, image in self.images.items():
+            yield file_name, image["width"], image["height"], self.annotations_for(file_name)
+
+
+def write_coco(path, images):
+    """Write (file_name, width, height, records) tuples to a COCO JSON file.
+
+    Annotations are written as they arrive; only the small image and category
+    tables are held until the end, which is why "annotations" comes first.
+    """
+    image_entries = []
+    categories = {}
+    ann_id = 0
+    # Written beside the target and moved into place at the end, because the images
+    # being exported may still be read from the file we are replacing
+    with replace_on_success(path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as fp:
+        fp.write('{"annotations": [')
+        for image_id, (file_name, width, height, records) in enumerate(images, 1):
+            image_entries.append({"id": image_id, "file_name": file_name, "width": width, "height": height})
+            for record in records:
+                category_id = categories.setdefault(record["text"], len(categories) + 1)
+                w, h = record["box_w"], record["box_h"]
+                ann_id += 1
+                ann = {
+                    "id": ann_id,
+                    "image_id": image_id,
+                    "category_id": category_id,
+                    "bbox": [record["end_x"] - w / 2, record["end_y"] - h / 2, w, h],
+                    "area": w * h,
+                    "iscrowd": 0,
+                    "attributes": {
+                        "text": record["text"],
+                        "label_x": record["x"],
+                        "label_y": record["y"],
+                        "size": record["size"],
+                        "color": record["color"],
+                        "arrow_th": record["arrow_th"],
+                        "arrow_length": record["arrow_length"],
+                    },
+                }
+                fp.write((",\n" if ann_id > 1 else "\n") + json.dumps(ann))
+        fp.write('\n],\n"images": ')
+        json.dump(image_entries, fp)
+        fp.write(',\n"categories": ')
+        json.dump([{"id": cid, "name": name} for name, cid in categories.items()], fp)
+        fp.write("}\n")
+
+
+class VocDataset:
+    """Index over a directory of Pascal VOC XML files, one file per image."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.images = {}  # file_name -> xml path
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(".xml"):
+                xml_path = os.path.join(directory, name)
+                try:
+                    file_name = self._read_filename(xml_path)
+                except ET.ParseError:
+                    # Not every XML file next to the annotations is a valid VOC file
+                    continue
+                if file_name:
+                    self.images[os.path.basename(file_name)] = xml_path
+
+    @staticmethod
+    def _read_filename(xml_path):
+        # Stop as soon as <filename> is seen instead of parsing every object
+        for _, elem in ET.iterparse(xml_path):
+            if elem.tag == "filename":
+                return (elem.text or "").strip()
+        return None
+
+    def __contains__(self, file_name):
+        return os.path.basename(file_name) in self.images
+
+    def annotations_for(self, file_name):
+        xml_path = self.images.get(os.path.basename(file_name))
+        if xml_path is None:
+            return []
+        records = []
+        for _, elem in ET.iterparse(xml_path):
+            if elem.tag == "object":
+                record = self._to_record(elem)
+                if record is not None:
+                    records.append(record)
+                elem.clear()
+        return records
+
+    @staticmethod
+    def _to_record(obj):
+        """Map one VOC <object> to a record, or None if its bounding box is missing or invalid."""
+        try:
+            box = obj.find("bndbox")
+            xmin, ymin, xmax, ymax = (float(box.findtext(tag)) for tag in ("xmin", "ymin", "xmax", "ymax"))
+        except (AttributeError, TypeError, ValueError):
+            return None
+        end_x, end_y = (xmin + xmax) / 2, (ymin + ymax) / 2
+        style = obj.find("annotation_tool")
+
+        def attr(tag, default, cast=float):
+            value = style.findtext(tag) if style is not None else None
+            try:
+                return cast(value) if value is not None else default
+            except ValueError:
+                return default
+
+        return make_record((obj.findtext("name") or "").strip(),
+                           attr("label_x", end_x), attr("label_y", end_y), end_x, end_y,
+                           attr("size", DEFAULT_SIZE, int), attr("color", DEFAULT_COLOR, str),
+                           attr("arrow_th", DEFAULT_ARROW_TH, int), attr("arrow_length", DEFAULT_ARROW_LENGTH, int),
+                           xmax - xmin, ymax - ymin)
+
+    def iter_images(self):
+        for file_name in self.images:
+            records = self.annotations_for(file_name)
+            size = ET.parse(self.images[file_name]).find("size")
+            yield file_name, _int_or_none(size, "width"), _int_or_none(size, "height"), records
+
+
+def _int_or_none(elem, tag):
+    try:
+        return int(float(elem.findtext(tag)))
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        return None
+
+
+def write_voc(path, file_name, width, height, records):
+    """Write one image's records as a Pascal VOC XML file."""
+    root = ET.Element("annotation")
+    ET.SubElement(root, "filename").text = file_name
+    size = ET.SubElement(root, "size")
+    ET.SubElement(size, "width").text = str(width)
+    ET.SubElement(size, "height").text = str(height)
+    ET.SubElement(size, "depth").text = "3"
+    for record in records:
+        obj = ET.SubElement(root, "object")
+        ET.SubElement(obj, "name").text = record["text"]
+        ET.SubElement(obj, "difficult").text = "0"
+        w, h = record["box_w"], record["box_h"]
+        box = ET.SubElement(obj, "bndbox")
+        ET.SubElement(box, "xmin").text = str(round(record["end_x"] - w / 2))
+        ET.SubElement(box, "ymin").text = str(round(record["end_y"] - h / 2))
+        ET.SubElement(box, "xmax").text = str(round(record["end_x"] + w / 2))
+        ET.SubElement(box, "ymax").text = str(round(record["end_y"] + h / 2))
+        # Non-standard block so our own labels round-trip; other VOC readers ignore it
+        style = ET.SubElement(obj, "annotation_tool")
+        for tag, key in (("label_x", "x"), ("label_y", "y"), ("size", "size"), ("color", "color"),
+                         ("arrow_th", "arrow_th"), ("arrow_length", "arrow_length")):
+            ET.SubElement(style, tag).text = str(record[key])
+    ET.indent(root)
+    with replace_on_success(path) as tmp_path:
+        ET.ElementTree(root).write(tmp_path, encoding="utf-8", xml_declaration=True)
+
+
+def write_voc_dir(directory, images):
+    """Write (file_name, width, height, records) tuples as one VOC XML file per image."""
+    for file_name, width, height, records in images:
+        stem = os.path.splitext(os.path.basename(file_name))[0]
+        write_voc(os.path.join(directory, stem + ".xml"), file_name, width, height, records)
@@ -0,0 +1,258 @@
+import math
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+from annotation_formats import replace_on_success
+
+LABEL_TEXT_COLOR = "#FFFFFF"
+FONT_NAMES = ("arial.ttf", "Arial.ttf", "DejaVuSans.ttf")
+
+
+def scale_annotation(x, y, x_end_arrow, y_end_arrow, size, arrow_length, arrow_th, cx, cy, zoom_level):
+    """Scale an annotation around (cx, cy), exactly as Annotation.draw_annotation does.
+
+    Returns (label_x, label_y, arrow_end_x, arrow_end_y, size, arrow_th) where the
+    label point is the left-middle anchor of the text.
+    """
+    new_length = int(arrow_length * zoom_level)
+    new_size = int(size * zoom_level)
+    new_th = int(arrow_th * zoom_level)
+    new_x = cx + (x - cx) * zoom_level
+    new_y = cy + (y - cy) * zoom_level
+    arrow_end_x = cx + (x_end_arrow - cx) * zoom_level
+    arrow_end_y = cy + (y_end_arrow - cy) * zoom_level
+    return new_x + new_length, new_y, arrow_end_x, arrow_end_y, new_size, new_th
+
+
+def label_padding(size):
+    return size / 2
+
+
+def arrow_shape(arrow_th):
+    """Tk arrowshape (neck distance, wing distance, wing overhang) for a line width."""
+    return (2 * arrow_th, 3 * arrow_th, arrow_th)
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache bounded by item count and/or total cost."""
+
+    def __init__(self, max_items=None, max_cost=None, cost=None):
+        self.max_items = max_items
+        self.max_cost = max_cost
+        self.cost = cost or (lambda value: 1)
+        self.total_cost = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, factory):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+        # Build outside the lock so one slow decode doesn't stall every worker
+        value = factory()
+        cost = self.cost(value)
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = (value, cost)
+                self.total_cost += cost
+                self._evict()
+        return value
+
+    def _evict(self):
+        while self._items and ((self.max_items is not None and len(self._items) > self.max_items) or
+                               (self.max_cost is not None and self.total_cost > self.max_cost)):
+            _, (_, cost) = self._items.popitem(last=False)
+            self.total_cost -= cost
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.total_cost = 0
+
+    def stats(self):
+        return {"items": len(self._items), "cost": self.total_cost, "hits": self.hits, "misses": self.misses}
+
+
+def image_nbytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+class Renderer:
+    """Draws annotation records onto images with PIL, keeping decoded images, fonts and labels warm."""
+
+    def __init__(self, image_cache_bytes=512 * 1024 * 1024, font_cache_size=64, sprite_cache_size=2048,
+                 sprite_cache_bytes=64 * 1024 * 1024, font_scale=1.0):
+        # Pixels per font size unit; the app passes Tk's scaling since canvas font sizes are points
+        self.font_scale = font_scale
+        self.images = LRUCache(max_cost=image_cache_bytes, cost=image_nbytes)
+        self.fonts = LRUCache(max_items=font_cache_size)
+        self.sprites = LRUCache(max_items=sprite_cache_size, max_cost=sprite_cache_bytes,
+                                cost=lambda sprite: image_nbytes(sprite[0]) * 2)
+
+    def load_image(self, image_path):
+        # mtime in the key so an edited file on disk is picked up again
+        key = (os.path.abspath(image_path), os.stat(image_path).st_mtime_ns)
+
+        def decode():
+            with Image.open(image_path) as img:
+                return img.convert("RGB")
+
+        return self.images.get(key, decode)
+
+    def font(self, size):
+        pixels = max(round(size * self.font_scale), 1)
+
+        def load():
+            for name in FONT_NAMES:
+                try:
+                    return ImageFont.truetype(name, pixels)
+                except OSError:
+                    pass
+            return ImageFont.load_default(pixels)
+
+        return self.fonts.get(pixels, load)
+
+    def label_sprite(self, text, size, color):
+        """Return (background, text layer, offset, text bbox) for a label anchored at (0, 0)."""
+        def build():
+            font = self.font(max(size, 1))
+            bbox = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font, anchor="lm")
+            pad = label_padding(size)
+            left, top = math.floor(bbox[0] - pad), math.floor(bbox[1] - pad)
+            width, height = math.ceil(bbox[2] + pad) - left, math.ceil(bbox[3] + pad) - top
+            background = Image.new("RGBA", (max(width, 1), max(height, 1)), (0, 0, 0, 0))
+            ImageDraw.Draw(background).rounded_rectangle((0, 0, width - 1, height - 1), radius=pad, fill=color)
+            text_layer = Image.new("RGBA", background.size, (0, 0, 0, 0))
+            ImageDraw.Draw(text_layer).text((-left, -top), text, fill=LABEL_TEXT_COLOR, font=font, anchor="lm")
+            return background, text_layer, (left, top), bbox
+
+        return self.sprites.get((text, size, color), build)
+
+    def output_size(self, img, width=None, height=None):
+        """Fit the image into width x height, keeping its aspect ratio like resize_image."""
+        if width and height:
+            scale = min(width / img.width, height / img.height)
+        elif width:
+            scale = width / img.width
+        elif height:
+            scale = height / img.height
+        else:
+            scale = 1
+        return max(round(img.width * scale), 1), max(round(img.height * scale), 1), scale
+
+    def render(self, image_path, records, width=None, height=None):
+        """Render annotation records (image pixel coordinates) and return a new RGB image."""
+        source = self.load_image(image_path)
+        out_w, out_h, scale = self.output_size(source, width, height)
+        if (out_w, out_h) == source.size:
+            img = source.copy()
+        else:
+            img = source.resize((out_w, out_h), Image.LANCZOS)
+        draw = ImageDraw.Draw(img)
+        for record in records:
+            self.draw_annotation(img, draw, record, scale)
+        return img
+
+    def draw_annotation(self, img, draw, record, zoom_level, origin=(0, 0)):
+        """Draw one record; origin is the position of img's top-left pixel, e.g. a band's offset."""
+        label_x, label_y, end_x, end_y, size, arrow_th = scale_annotation(
+            record["x"], record["y"], record["end_x"], record["end_y"],
+            record["size"], record["arrow_length"], record["arrow_th"], 0, 0, zoom_level)
+        label_x, label_y = label_x - origin[0], label_y - origin[1]
+        end_x, end_y = end_x - origin[0], end_y - origin[1]
+        background, text_layer, (dx, dy), bbox = self.label_sprite(record["text"], size, record["color"])
+        # Round before shifting so a label split across bands lines up exactly
+        pos = (round(label_x + origin[0] + dx) - origin[0], round(label_y + origin[1] + dy) - origin[1])
+        # Same stacking as on the canvas: label background, then arrow, then text
+        img.paste(background, pos, background)
+        start = (label_x + (bbox[0] + bbox[2]) / 2, label_y)
+        draw_arrow(draw, start, (end_x, end_y), arrow_th, record["color"])
+        img.paste(text_layer, pos, text_layer)
+
+    def iter_bands(self, img, records, band_height):
+        """Yield img with records drawn on it, as RGB strips of at most band_height rows.
+
+        Only one strip is alive at a time, so exporting never needs a second full copy.
+        """
+        band_height = max(int(band_height), 1)
+        for top in range(0, img.height, band_height):
+            band = img.crop((0, top, img.width, min(top + band_height, img.height))).convert("RGB")
+            draw = ImageDraw.Draw(band)
+            for record in records:
+                self.draw_annotation(band, draw, record, 1, origin=(0, top))
+            yield band
+
+    def save(self, path, img, records, band_height=256):
+        """Save img with records drawn on it. PNG is streamed band by band.
+
+        The file is written next to path and only replaces it once complete.
+        """
+        with replace_on_success(path) as tmp_path:
+            if os.path.splitext(path)[1].lower() == ".png":
+                write_png(tmp_path, img.width, img.height, self.iter_bands(img, records, band_height))
+                return
+            # Other encoders need the whole picture, so bands are assembled into a single output image
+            out = Image.new("RGB", img.size)
+            top = 0
+            for band in self.iter_bands(img, records, band_height):
+                out.paste(band, (0, top))
+                top += band.height
+            # The temporary name keeps the extension, but pass the format explicitly anyway
+            out.save(tmp_path, format=Image.registered_extensions().get(os.path.splitext(path)[1].lower()))
+
+
+def _png_chunk(fp, kind, data):
+    fp.write(struct.pack(">I", len(data)) + kind + data)
+    fp.write(struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+def write_png(path, width, height, bands):
+    """Write RGB bands top to bottom as a single 8-bit PNG without holding the whole image."""
+    compressor = zlib.compressobj(6)
+    stride = width * 3
+    with open(path, "wb") as fp:
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        _png_chunk(fp, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        for band in bands:
+            raw = band.tobytes()
+            # Filter type 0 (None) in front of every scanline
+            rows = b"".join(b"\x00" + raw[i:i + stride] for i in range(0, len(raw), stride))
+            data = compressor.compress(rows)
+            if data:
+                _png_chunk(fp, b"IDAT", data)
+        _png_chunk(fp, b"IDAT", compressor.flush())
+        _png_chunk(fp, b"IEND", b"")
+
+
+def draw_arrow(draw, start, end, width, color):
+    """Draw a round-capped line with a Tk-style arrowhead at end."""
+    width = max(width, 1)
+    neck, wing, overhang = arrow_shape(width)
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return
+    ux, uy = dx / length, dy / length
+    px, py = -uy, ux
+    neck_pt = (end[0] - ux * neck, end[1] - uy * neck)
+    back = (end[0] - ux * wing, end[1] - uy * wing)
+    spread = width / 2 + overhang
+    if length > neck:
+        draw.line((start, neck_pt), fill=color, width=width)
+        r = width / 2
+        draw.ellipse((start[0] - r, start[1] - r, start[0] + r, start[1] + r), fill=color)
+    draw.polygon([end, (back[0] + px * spread, back[1] + py * spread), neck_pt,
+                  (back[0] - px * spread, back[1] - py * spread)], fill=color)
@@ -3,44 +3,91 @@ from tkinter import filedialog, simpledialog, messagebox
 from PIL import Image, ImageTk
 import tkinter.colorchooser as colorchooser
 from tkinter import font
-import io
+import math
+import os
+import xml.etree.ElementTree as ET
+import annotation_formats
+import annotation_render
+import memory_budget
+
+# Slider previews are redrawn at most this often
+PREVIEW_INTERVAL_MS = 50
+
+def rounded_rectangle_points(x1, y1, x2, y2, radius):
+    return [x1 + radius, y1,
+            x2 - radius, y1,
+            x2, y1,
+            x2, y1 + radius,
+            x2, y2 - radius,
+            x2, y2,
+            x2 - radius, y2,
+            x1 + radius, y2,
+            x1, y2,
+            x1, y2 - radius,
+            x1, y1 + radius,
+            x1, y1]
+
+def reducible_image(img):
+    """Convert modes Image.reduce() rejects or averages wrongly (bilevel, palette, 16-bit)."""
+    if img.mode == "1":
+        return img.convert("L")
+    if img.mode in ("P", "PA"):
+        return img.convert("RGBA" if img.mode == "PA" or "transparency" in img.info else "RGB")
+    if img.mode.startswith("I;16"):
+        # Scale 16-bit samples down to 8 bits for display
+        return img.convert("I").point(lambda v: v / 256).convert("L")
+    return img
+
+def reduce_peak_per_pixel(mode):
+    """Bytes per source pixel alive while an image of this mode is decoded and made reducible."""
+    # PIL keeps bilevel, grey and palette images at 1 byte/pixel, 16-bit at 2 and everything else at 4
+    decoded = 1 if mode in ("1", "L", "P") else 2 if mode.startswith("I;16") else 4
+    if mode == "1":
+        return decoded + 1
+    if mode in ("P", "PA"):
+        return decoded + 4
+    if mode.startswith("I;16"):
+        # The 32-bit copy and the result of point() exist at the same time
+        return decoded + 8
+    return decoded
 
 def rounded_rectangle(canvas, x1, y1, x2, y2, radius, **kwargs):
-    points = [x1 + radius, y1,
-              x2 - radius, y1,
-              x2, y1,
-              x2, y1 + radius,
-              x2, y2 - radius,
-              x2, y2,
-              x2 - radius, y2,
-              x1 + radius, y2,
-              x1, y2,
-              x1, y2 - radius,
-              x1, y1 + radius,
-              x1, y1]
+    points = rounded_rectangle_points(x1, y1, x2, y2, radius)
     return canvas.create_polygon(points, **kwargs, smooth=True)
 
 class AnnotationSettings(tk.Toplevel):
-    def __init__(self, parent, selected_annotation):
+    def __init__(self, parent, selected_annotations):
         super().__init__(parent.root, bg="#3C3C3C")
-        self.title("Annotation Settings")
-        self.selected_annotation = selected_annotation
+        self.selected_annotations = selected_annotations
+        first = selected_annotations[0]
+        if len(selected_annotations) == 1:
+            self.title("Annotation Settings")
+        else:
+            self.title("Annotation Settings (%d selected)" % len(selected_annotations))
         self.parent = parent
         self.center_window()
         self.attributes("-topmost", True)
+        # Styles before editing, restored if the window is closed without OK
+        self.original_styles = [(ann.text, ann.size, ann.color, ann.arrow_th) for ann in selected_annotations]
+        self.preview_job = None
+        # Controls the user has changed; only those are applied to the selection
+        self.touched = set()
         
         # Fonts
         custom_font = font.Font(family="Helvetica", size=10, weight="bold")
         
-        # Text input for changing annotation text
-        tk.Label(self, text="Annotation Text:", bg="#3C3C3C", fg="white").pack(padx=10, pady=5, anchor=tk.W)
-        self.annotation_input = tk.Entry(self, bg="#555555", fg="white", insertbackground="white")
-        self.annotation_input.pack(padx=10, pady=5, fill=tk.X)
-        self.annotation_input.insert(0, selected_annotation.text)
+        # Text input for changing annotation text (only makes sense for a single annotation)
+        self.annotation_input = None
+        if len(selected_annotations) == 1:
+            tk.Label(self, text="Annotation Text:", bg="#3C3C3C", fg="white").pack(padx=10, pady=5, anchor=tk.W)
+            self.annotation_input = tk.Entry(self, bg="#555555", fg="white", insertbackground="white")
+            self.annotation_input.pack(padx=10, pady=5, fill=tk.X)
+            self.annotation_input.insert(0, first.text)
         
         # Slider for adjusting size (Note: Sliders don't support bg in the native tkinter)
-        self.size_slider = tk.Scale(self, from_=5, to=100, orient=tk.HORIZONTAL, label="Size", fg="#3C3C3C")
-        self.size_slider.set(selected_annotation.size)
+        self.size_var = tk.IntVar(value=first.size)
+        self.size_slider = tk.Scale(self, from_=5, to=100, orient=tk.HORIZONTAL, label="Size", fg="#3C3C3C",
+                                    variable=self.size_var)
         self.size_slider.pack(padx=10, pady=5)
         
         # # Slider for adjusting arrow length
@@ -49,12 +96,16 @@ class AnnotationSettings(tk.Toplevel):
         # self.arrow_length_slider.pack(padx=10, pady=5)
         
         # Slider for adjusting arrow width
-        self.arrow_width_slider = tk.Scale(self, from_=2, to=100, orient=tk.HORIZONTAL, label="Arrow width", fg="#3C3C3C")
-        self.arrow_width_slider.set(selected_annotation.arrow_th)
+        self.arrow_width_var = tk.IntVar(value=first.arrow_th)
+        self.arrow_width_slider = tk.Scale(self, from_=2, to=100, orient=tk.HORIZONTAL, label="Arrow width", fg="#3C3C3C",
+                                           variable=self.arrow_width_var)
         self.arrow_width_slider.pack(padx=10, pady=5)
+        # Traced only after the initial values are in, so every write comes from the user
+        self.size_var.trace_add("write", lambda *args: self.touch("size"))
+        self.arrow_width_var.trace_add("write", lambda *args: self.touch("arrow_th"))
         
         # Color Picker Button
-        self.color = selected_annotation.color
+        self.color = first.color
         self.color_btn = tk.Button(self, text="Pick Color", command=self.pick_color, bg=self.color, 
                                    fg="white", font=custom_font, relief=tk.GROOVE, padx=10, pady=5)
         self.color_btn.pack(padx=10, pady=5)
@@ -67,6 +118,7 @@ class AnnotationSettings(tk.Toplevel):
         self.ok_btn = tk.Button(self, text="OK", command=self.apply_changes, bg="#555555", fg="white", 
                                 font=custom_font, relief=tk.GROOVE, padx=10, pady=5)
         self.ok_btn.pack(padx=10, pady=10)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
 
     def on_enter(self, event):
         """Change the button color when mouse hovers over it."""
@@ -82,6 +134,7 @@ class AnnotationSettings(tk.Toplevel):
         if color:
             self.color_btn.config(bg=color)
             self.color = color  # Store the chosen color
+            self.touch("color")
 
     def center_window(self):
         """Center the window on the screen."""
@@ -96,36 +149,40 @@ class AnnotationSettings(tk.Toplevel):
         # Set the window's position
         self.geometry('+%d+%d' % (x, y))
 
+    def touch(self, control):
+        self.touched.add(control)
+        self.schedule_preview()
+
+    def schedule_preview(self):
+        """Coalesce slider movements into one preview every PREVIEW_INTERVAL_MS."""
+        if self.preview_job is None:
+            self.preview_job = self.after(PREVIEW_INTERVAL_MS, self.preview)
+
+    def preview(self):
+        self.preview_job = None
+        size, arrow_th, color = self.size_slider.get(), self.arrow_width_slider.get(), self.color
+        for ann, (_, original_size, original_color, original_arrow_th) in zip(self.selected_annotations, self.original_styles):
+            ann.restyle(size if "size" in self.touched else original_size,
+                        color if "color" in self.touched else original_color,
+                        arrow_th if "arrow_th" in self.touched else original_arrow_th,
+                        self.parent.zoom_level)
+
+    def cancel(self):
+        if self.preview_job is not None:
+            self.after_cancel(self.preview_job)
+        for ann, (text, size, color, arrow_th) in zip(self.selected_annotations, self.original_styles):
+            ann.set_text(text)
+            ann.restyle(size, color, arrow_th, self.parent.zoom_level)
+        self.destroy()
+
     def apply_changes(self):
-        self.selected_annotation.text = self.annotation_input.get()
-        self.selected_annotation.size = self.size_slider.get()
+        if self.preview_job is not None:
+            self.after_cancel(self.preview_job)
+        if self.annotation_input is not None:
+            self.selected_annotations[0].set_text(self.annotation_input.get())
         # self.selected_annotation.arrow_length = self.arrow_length_slider.get()
-        self.selected_annotation.arrow_th = self.arrow_width_slider.get()
-        self.selected_annotation.color = self.color
-        # Update the visual representation of the annotation
-        cx, cy = self.parent.canvas.winfo_width() // 2, self.parent.canvas.winfo_height() // 2
-        self.parent.canvas.delete(self.selected_annotation.arrow)
-        self.parent.canvas.delete(self.selected_annotation.text_id)
-        self.parent.canvas.delete(self.selected_annotation.rect_id)
-        self.selected_annotation.draw_annotation(  
-            self.selected_annotation.current_coords[0], 
-            self.selected_annotation.current_coords[1], 
-            self.selected_annotation.arrow_endpoint[0], 
-            self.selected_annotation.arrow_endpoint[1],
-            self.selected_annotation.size,
-            self.selected_annotation.arrow_length,
-            cx, cy,
-            self.parent.zoom_level,
-            self.selected_annotation.color ,
-            self.selected_annotation.arrow_th
-        )
-        
-        # Change the color
-        # self.parent.canvas.itemconfig(self.selected_annotation.rect_id, fill=self.color)
-        # self.parent.canvas.itemconfig(self.selected_annotation.arrow, fill=self.color)
-        
-        # Rebind events
-        self.selected_annotation.bind_events()
+        # Update the existing canvas items of the whole selection in one pass
+        self.preview()
         
         # Close the settings window
         self.destroy()
@@ -146,25 +203,20 @@ class Annotation:
         self.bind_events()
         self.relative_coords = (x / img_width, y / img_height)
         self.drag_data = {"x": 0, "y": 0, "item": None}
+        self.box_size = (0, 0)  # Width/height of the bounding box this came from, if imported
 
     def draw_annotation(self, x, y, x_end_arrow, y_end_arrow,size,arrow_length,cx, cy,zoom_level,color,arrow_th):
-        new_length = int(arrow_length * zoom_level)
-        new_size = int(size * zoom_level)
-        new_th=int(arrow_th * zoom_level)
-        # Calculate new position for text based on current_coords
-        new_x = cx + (x - cx) * zoom_level
-        new_y = cy + (y - cy) * zoom_level
-        
-        # Calculate new position for arrow endpoint based on arrow_endpoint
-        arrow_end_x = cx + (x_end_arrow - cx) * zoom_level
-        arrow_end_y = cy + (y_end_arrow - cy) * zoom_level
+        # Shared with the render service so both produce the same layout
+        label_x, new_y, arrow_end_x, arrow_end_y, new_size, new_th = annotation_render.scale_annotation(
+            x, y, x_end_arrow, y_end_arrow, size, arrow_length, arrow_th, cx, cy, zoom_level)
         
-        self.text_id = self.canvas.create_text(new_x + new_length, new_y, text=self.text, fill="#FFFFFF", font=('Arial', new_size), anchor=tk.W)
+        self.text_id = self.canvas.create_text(label_x, new_y, text=self.text, fill="#FFFFFF", font=('Arial', new_size), anchor=tk.W)
         bbox = self.canvas.bbox(self.text_id)
-        padded_bbox = (bbox[0] - new_size/2, bbox[1] - new_size/2, bbox[2] + new_size/2, bbox[3] + new_size/2)
-        self.rect_id = rounded_rectangle(self.canvas, *padded_bbox, radius=new_size/2, fill=color)
+        pad = annotation_render.label_padding(new_size)
+        padded_bbox = (bbox[0] - pad, bbox[1] - pad, bbox[2] + pad, bbox[3] + pad)
+        self.rect_id = rounded_rectangle(self.canvas, *padded_bbox, radius=pad, fill=color)
         self.canvas.tag_lower(self.rect_id, self.text_id)
-        arrow_shape = (2*new_th, 3*new_th, new_th)  # Example values; adjust for your needs
+        arrow_shape = annotation_render.arrow_shape(new_th)
 
         self.arrow = self.canvas.create_line(
     bbox[0] + ((bbox[2] - bbox[0]) / 2), new_y, 
@@ -178,6 +230,32 @@ class Annotation:
     arrowshape=arrow_shape
 )
         self.canvas.tag_lower(self.arrow, self.text_id)
+        if self.selected:
+            self.select()
+
+    def set_text(self, text):
+        self.text = text
+        self.canvas.itemconfig(self.text_id, text=text)
+
+    def restyle(self, size, color, arrow_th, zoom_level):
+        """Change size, color and arrow width by updating the existing canvas items in place."""
+        self.size = size
+        self.color = color
+        self.arrow_th = arrow_th
+        new_size = int(size * zoom_level)
+        new_th = int(arrow_th * zoom_level)
+        self.canvas.itemconfig(self.text_id, font=('Arial', new_size))
+        bbox = self.canvas.bbox(self.text_id)
+        if bbox is None:
+            # The canvas items are gone (e.g. another image was opened); just keep the new style
+            return
+        pad = annotation_render.label_padding(new_size)
+        self.canvas.coords(self.rect_id, *rounded_rectangle_points(bbox[0] - pad, bbox[1] - pad, bbox[2] + pad, bbox[3] + pad, pad))
+        self.canvas.itemconfig(self.rect_id, fill=color)
+        text_y = self.canvas.coords(self.text_id)[1]
+        x0, y0, x1, y1 = self.canvas.coords(self.arrow)
+        self.canvas.coords(self.arrow, bbox[0] + ((bbox[2] - bbox[0]) / 2), text_y, x1, y1)
+        self.canvas.itemconfig(self.arrow, fill=color, width=new_th, arrowshape=annotation_render.arrow_shape(new_th))
 
     def bind_events(self):
         self.canvas.tag_bind(self.text_id, '<Button-3>', self.on_start_drag)
@@ -197,7 +275,7 @@ class Annotation:
         self.select()
         
         # Open the Annotation Settings window
-        settings_window = AnnotationSettings(self.app, self)
+        self.app.open_settings([self])
 
     def deselect(self):
         self.selected = False
@@ -302,8 +380,18 @@ class ImageAnnotationApp:
         self.zoom_in_btn.pack(side=tk.LEFT, padx=5, pady=5)
         self.zoom_out_btn = RoundedButton(toolbar, text="Zoom Out", command=self.zoom_out, width=90, height=30)
         self.zoom_out_btn.pack(side=tk.LEFT, padx=5, pady=5)
+        self.import_btn = RoundedButton(toolbar, text="Import", command=self.import_dataset, width=70, height=30)
+        self.import_btn.pack(side=tk.LEFT, padx=5, pady=5)
+        self.export_btn = RoundedButton(toolbar, text="Export", command=self.export_dataset, width=70, height=30)
+        self.export_btn.pack(side=tk.LEFT, padx=5, pady=5)
+        self.style_btn = RoundedButton(toolbar, text="Style", command=self.style_selection, width=60, height=30)
+        self.style_btn.pack(side=tk.LEFT, padx=5, pady=5)
         self.exit_btn = RoundedButton(toolbar, text="Exit", command=self.close_app, width=60, height=30)
         self.exit_btn.pack(side=tk.RIGHT, padx=5, pady=5)
+        # Current memory use; click to change the budget
+        self.memory_label = tk.Label(toolbar, bg="#3C3C3C", fg="#FFFFFF", cursor="hand2")
+        self.memory_label.pack(side=tk.RIGHT, padx=5, pady=5)
+        self.memory_label.bind("<Button-1>", self.change_memory_budget)
 
         self.canvas = tk.Canvas(self.root, bg="#1A1A1A", cursor="cross", highlightthickness=0)  # Dark theme canvas
         self.canvas.pack(pady=20, padx=20, fill=tk.BOTH, expand=True)
@@ -312,6 +400,9 @@ class ImageAnnotationApp:
         self.img = None
         self.img_tk = None
         self.image_id = None
+        self.image_size = None  # Size of the file on disk; self.img may be smaller under memory pressure
+        self.image_scale = 1
+        self.photo_region = None  # Part of the zoomed image shown when it is too big to keep whole
         self.annotations = []
         self.canvas.annotations = self.annotations
         self.zoom_level = 1
@@ -319,16 +410,45 @@ class ImageAnnotationApp:
         self.canvas.bind("<Button-1>", self.start_pan)
         self.canvas.bind("<B1-Motion>", self.continue_pan)
         self.canvas.bind("<ButtonRelease-1>", self.check_click_or_drag)
+        # Shift-click toggles an annotation in the selection, shift-drag selects with a rubber band
+        self.canvas.bind("<Shift-Button-1>", self.start_select_box)
+        self.canvas.bind("<Shift-B1-Motion>", self.drag_select_box)
+        self.canvas.bind("<Shift-ButtonRelease-1>", self.end_select_box)
+        self.select_box_id = None
+        self.select_box_start = (0, 0)
+        self.settings_window = None
         self.undo_stack = []
         self.redo_stack = []
+        # Imported COCO/VOC dataset and the records of images edited this session
+        self.dataset = None
+        self.edited_records = {}
+
+        # Every large buffer is accounted here so the app stays inside one memory budget
+        self.memory = memory_budget.MemoryBudget(on_change=self.update_memory_label)
+        self.renderer = annotation_render.Renderer(font_scale=float(self.root.tk.call("tk", "scaling")))
+        self.memory.track("label cache", lambda: self.renderer.sprites.total_cost, self.renderer.sprites.clear)
 
     def load_image(self):
         file_path = filedialog.askopenfilename()
         if file_path:
+            try:
+                img, image_size = self.open_within_budget(file_path)
+            except (OSError, ValueError, MemoryError) as e:
+                # The current image and its annotations stay as they were
+                messagebox.showerror("Open failed", "Could not open %s: %s" % (file_path, e))
+                return
+            # The settings window edits annotations that are about to be removed
+            self.close_settings()
+            # Keep the annotations of the image we are leaving so they can be exported later
+            if self.img:
+                self.edited_records[os.path.basename(self.image_path)] = self.image_size + (self.get_records(),)
             self.image_path = file_path
-            self.img = Image.open(self.image_path)
+            self.img, self.image_size = img, image_size
+            self.image_scale = image_size[0] / img.width
+            self.img_tk = None
+            self.memory.release("photo")
+            self.memory.set("image", annotation_render.image_nbytes(img))
             # self.img = self.resize_image(self.img, self.canvas.winfo_width(), self.canvas.winfo_height())
-            self.img_tk = ImageTk.PhotoImage(self.img)
             
             # Delete any existing annotations before loading a new image
             if self.annotations:
@@ -338,12 +458,179 @@ class ImageAnnotationApp:
                     self.canvas.delete(annotation.arrow)
                 self.annotations.clear()
 
-            # Delete the previous image if present
-            if self.image_id:
-                self.canvas.delete(self.image_id)
-            
-            # Create the new image on the canvas
-            self.image_id = self.canvas.create_image(self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2, anchor=tk.CENTER, image=self.img_tk)
+            # Create the new image on the canvas, replacing the previous one
+            self.render_photo()
+
+            # Annotations from an imported dataset are only built now that their image is open
+            file_name = os.path.basename(file_path)
+            if file_name in self.edited_records:
+                self.add_records(self.edited_records[file_name][2])
+            elif self.dataset and file_name in self.dataset:
+                try:
+                    records = self.dataset.annotations_for(file_name)
+                except (OSError, ValueError, ET.ParseError) as e:
+                    messagebox.showerror("Import failed", "Could not read annotations for %s: %s" % (file_name, e))
+                    records = []
+                self.add_records(records)
+
+    def open_within_budget(self, file_path):
+        """Open an image, decoding it at reduced resolution if it would not fit in the memory budget.
+
+        Returns (image, size of the file on disk) and leaves the app's current image alone.
+        """
+        img = Image.open(file_path)
+        image_size = img.size
+        # Room for the decoded pixels plus a 4 bytes/pixel PhotoImage at zoom level 1;
+        # the current image and photo are about to be replaced, so their room counts as free
+        per_pixel = len(img.getbands()) + 4
+        needed = img.width * img.height * per_pixel
+        replacing = ("image", "photo")
+        if not self.memory.reserve(needed, replacing=replacing):
+            free = self.memory.available() + sum(self.memory.size_of(name) for name in replacing)
+            factor = math.ceil(math.sqrt(needed / max(free, 1)))
+            target_width = max(img.width // factor, 1)
+            # JPEG can decode straight to a smaller size; reduce() finishes the job for other formats
+            img.draft(img.mode, (target_width, max(img.height // factor, 1)))
+            # Without draft support the whole image is still decoded before reduce(), so refuse
+            # instead of quietly going over the budget
+            peak = img.width * img.height * reduce_peak_per_pixel(img.mode)
+            if not self.memory.reserve(peak, replacing=replacing):
+                img.close()
+                raise ValueError("decoding it needs %d MB but only %d MB of the memory budget is free. "
+                                 "Raise the budget by clicking the memory display."
+                                 % (math.ceil(peak / memory_budget.MB), free // memory_budget.MB))
+            remaining = math.ceil(img.width / target_width)
+            if remaining > 1:
+                img = reducible_image(img).reduce(remaining)
+            messagebox.showwarning("Memory", "The image is too large for the memory budget and was opened at 1/%d resolution."
+                                   % round(image_size[0] / img.width))
+        img.load()
+        return img, image_size
+
+    def render_photo(self):
+        """Show self.img at the current zoom, limited to the visible area if the whole would not fit."""
+        cx, cy = self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2
+        new_width = max(int(self.img.width * self.zoom_level), 1)
+        new_height = max(int(self.img.height * self.zoom_level), 1)
+        left, top = cx - new_width // 2, cy - new_height // 2
+        region = (0, 0, new_width, new_height)
+        # PhotoImage keeps 4 bytes/pixel, and the resized PIL copy needs 3 more while it is built
+        if not self.memory.reserve(new_width * new_height * 7, replacing="photo"):
+            view = (self.canvas.canvasx(0) - left, self.canvas.canvasy(0) - top,
+                    self.canvas.canvasx(self.canvas.winfo_width()) - left, self.canvas.canvasy(self.canvas.winfo_height()) - top)
+            region = (max(int(view[0]), 0), max(int(view[1]), 0),
+                      min(math.ceil(view[2]), new_width), min(math.ceil(view[3]), new_height))
+        self.photo_region = None if region == (0, 0, new_width, new_height) else region
+        if self.image_id:
+            self.canvas.delete(self.image_id)
+        self.image_id = None
+        self.img_tk = None
+        if region[2] <= region[0] or region[3] <= region[1]:
+            self.memory.release("photo")
+            return
+        source_box = tuple(v / self.zoom_level for v in region)
+        resized_img = self.img.resize((region[2] - region[0], region[3] - region[1]), Image.LANCZOS, box=source_box)
+        self.img_tk = ImageTk.PhotoImage(resized_img)
+        self.memory.set("photo", resized_img.width * resized_img.height * 4)
+        del resized_img
+        self.image_id = self.canvas.create_image(left + region[0], top + region[1], anchor=tk.NW, image=self.img_tk)
+        self.canvas.tag_lower(self.image_id)
+
+    def update_memory_label(self, memory):
+        self.memory_label.config(text=memory.usage_text())
+
+    def change_memory_budget(self, event=None):
+        budget = simpledialog.askinteger("Memory", "Memory budget in MB:", initialvalue=self.memory.budget // memory_budget.MB, minvalue=64)
+        if budget:
+            self.memory.set_budget(budget * memory_budget.MB)
+            if self.img:
+                # Fall back to showing only the visible area if the zoomed image no longer fits
+                self.render_photo()
+
+    def image_origin(self):
+        """Canvas position of the image's top-left pixel at zoom level 1."""
+        cx, cy = self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2
+        return cx - self.img.width / 2, cy - self.img.height / 2
+
+    def get_records(self, full_resolution=True):
+        """Return the current annotations as records in image pixel coordinates.
+
+        With full_resolution the coordinates and label styles refer to the file on disk
+        rather than self.img, so a label keeps its size relative to the picture.
+        """
+        ox, oy = self.image_origin()
+        scale = self.image_scale if full_resolution else 1
+        records = []
+        for ann in self.annotations:
+            # box_size is kept in file pixels
+            box_w, box_h = (v * scale / self.image_scale for v in ann.box_size)
+            records.append(annotation_formats.make_record(
+                ann.text, (ann.current_coords[0] - ox) * scale, (ann.current_coords[1] - oy) * scale,
+                (ann.arrow_endpoint[0] - ox) * scale, (ann.arrow_endpoint[1] - oy) * scale,
+                round(ann.size * scale), ann.color, round(ann.arrow_th * scale), round(ann.arrow_length * scale),
+                box_w, box_h))
+        return records
+
+    def add_records(self, records):
+        """Create canvas annotations for records given in image pixel coordinates of the file on disk."""
+        ox, oy = self.image_origin()
+        cx, cy = self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2
+        scale = self.image_scale
+        for record in records:
+            annotation = Annotation(self.canvas, self, record["x"] / scale + ox, record["y"] / scale + oy, record["text"],
+                                    max(round(record["size"] / scale), 1), record["color"],
+                                    max(round(record["arrow_th"] / scale), 1), round(record["arrow_length"] / scale),
+                                    (record["end_x"] / scale + ox, record["end_y"] / scale + oy),
+                                    self.img.width, self.img.height, cx, cy, self.zoom_level)
+            annotation.box_size = (record["box_w"], record["box_h"])
+            self.annotations.append(annotation)
+
+    def import_dataset(self):
+        file_path = filedialog.askopenfilename(filetypes=[("COCO JSON", "*.json"),
+                                                          ("Pascal VOC XML", "*.xml"),
+                                                          ("All files", "*.*")])
+        if not file_path:
+            return
+        try:
+            if file_path.lower().endswith(".xml"):
+                # VOC keeps one file per image, so take every XML file in that folder
+                self.dataset = annotation_formats.VocDataset(os.path.dirname(file_path))
+            else:
+                self.dataset = annotation_formats.CocoDataset(file_path)
+        except (OSError, ValueError, KeyError, TypeError, ET.ParseError) as e:
+            messagebox.showerror("Import failed", str(e))
+            return
+        self.edited_records.clear()
+        messagebox.showinfo("Import", "Imported annotations for %d images. Open an image to see them." % len(self.dataset.images))
+
+    def iter_export_images(self):
+        """Yield (file_name, width, height, records), preferring edits made this session."""
+        edited = dict(self.edited_records)
+        if self.img:
+            edited[os.path.basename(self.image_path)] = self.image_size + (self.get_records(),)
+        for file_name, (width, height, records) in edited.items():
+            yield file_name, width, height, records
+        if self.dataset:
+            for file_name, width, height, records in self.dataset.iter_images():
+                if file_name not in edited:
+                    yield file_name, width, height, records
+
+    def export_dataset(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                 filetypes=[("COCO JSON", "*.json"),
+                                                            ("Pascal VOC XML", "*.xml")])
+        if not file_path:
+            return
+        try:
+            if file_path.lower().endswith(".xml"):
+                # One XML per image, written next to the chosen file
+                annotation_formats.write_voc_dir(os.path.dirname(file_path), self.iter_export_images())
+            else:
+                annotation_formats.write_coco(file_path, self.iter_export_images())
+        except (OSError, ValueError, ET.ParseError) as e:
+            messagebox.showerror("Export failed", str(e))
+            return
+        messagebox.showinfo("Success", "Annotations exported successfully!", icon=messagebox.INFO)
 
     def close_app(self):
         response = messagebox.askokcancel("Confirm Exit", "If you exit, you are going to lose any unsaved changes. Are you sure?")
@@ -361,79 +648,46 @@ class ImageAnnotationApp:
 
     def save_image(self):
         # Check if there's an image loaded
-        if self.image_id:
+        if self.img:
             # Create a filename for saving
             file_path = filedialog.asksaveasfilename(defaultextension=".png",
                                                     filetypes=[("PNG files", "*.png"),
                                                                 ("JPEG files", "*.jpg"),
                                                                 ("All files", "*.*")])
+            if file_path and self.image_scale != 1:
+                overwrite = os.path.abspath(file_path) == os.path.abspath(self.image_path)
+                if not messagebox.askokcancel(
+                        "Reduced resolution",
+                        "This image was opened at 1/%d resolution to fit the memory budget, so it will be saved at %dx%d "
+                        "instead of %dx%d.%s Save anyway?"
+                        % (round(self.image_scale), self.img.width, self.img.height, *self.image_size,
+                           " This replaces the original file with the smaller copy." if overwrite else ""),
+                        icon=messagebox.WARNING):
+                    return
             if file_path:
-                # Backup current zoom level and window size
-                original_zoom = self.zoom_level
-                original_window_size = self.root.geometry()
-
-                # Reset zoom and center the image
-                self.zoom_level = 1
-                self.update_image_zoom()
-
-                # Create a higher-resolution canvas
-                high_res_factor = 3  # Factor to increase resolution
-                high_res_width = self.canvas.winfo_width() * high_res_factor
-                high_res_height = self.canvas.winfo_height() * high_res_factor
-                high_res_canvas = tk.Canvas(self.root, width=high_res_width, height=high_res_height, bg="#1A1A1A")
-
-                # Draw the high-resolution image on the canvas
-                high_res_canvas_image = self.img.resize((self.img.width * high_res_factor, self.img.height * high_res_factor))
-                high_res_img_tk = ImageTk.PhotoImage(high_res_canvas_image)
-                high_res_canvas.create_image(high_res_width // 2, high_res_height // 2, image=high_res_img_tk)
-
-                # Render annotations on high-res canvas
-                temp_annotations = []  # List to hold temporary annotations for high_res_canvas
-                for annotation in self.annotations:
-                    cx, cy = high_res_width // 2, high_res_height // 2
-                    size=annotation.size* high_res_factor
-                    color=annotation.color
-                    arrow_th=annotation.arrow_th* high_res_factor
-                    arrow_length=annotation.arrow_length* high_res_factor
-                    arrow_endpoint=(annotation.arrow_endpoint[0]* high_res_factor,annotation.arrow_endpoint[1]* high_res_factor)
-                    temp_annotation = Annotation(high_res_canvas, self,
-                                                annotation.current_coords[0] * high_res_factor,
-                                                annotation.current_coords[1] * high_res_factor,
-                                                annotation.text,
-                                                size,color,arrow_th,arrow_length,arrow_endpoint,
-                                                self.img.width * high_res_factor, 
-                                                self.img.height * high_res_factor,
-                                                cx, cy,
-                                                self.zoom_level)
-                    temp_annotation.color = annotation.color
-                    temp_annotation.arrow_th = annotation.arrow_th
-                    temp_annotation.size = annotation.size
-                    temp_annotation.arrow_length = annotation.arrow_length
-                    temp_annotations.append(temp_annotation)
-
-                # Temporarily resize the window to fit the high-res canvas
-                self.root.geometry(f"{high_res_width}x{high_res_height}")
-                self.canvas.pack_forget()
-                high_res_canvas.pack(pady=20, padx=20, fill=tk.BOTH, expand=True)
-                self.root.update_idletasks()
-
-                # Export high-res canvas content to postscript
-                ps = high_res_canvas.postscript(colormode='color', width=high_res_width, height=high_res_height)
-
-                # Convert to image using PIL
-                img = Image.open(io.BytesIO(ps.encode('utf-8')))
-
-                # Crop to image size
-                
-                # Save the image
-                img.save(file_path)
-
-                # Restore original canvas, zoom level, and window size
-                high_res_canvas.pack_forget()
-                self.canvas.pack(pady=20, padx=20, fill=tk.BOTH, expand=True)
-                self.zoom_level = original_zoom
-                self.update_image_zoom()
-                self.root.geometry(original_window_size)
+                # Draw straight onto the image in horizontal bands instead of rasterising
+                # a 3x canvas, so only one band exists besides self.img
+                band_height = max(16, min(256, self.memory.available() // max(self.img.width * 3, 1)))
+                if os.path.splitext(file_path)[1].lower() == ".png":
+                    self.memory.set("export", self.img.width * band_height * 3)
+                else:
+                    # Other formats are encoded from one assembled image
+                    nbytes = self.img.width * (self.img.height + band_height) * 3
+                    if not self.memory.reserve(nbytes):
+                        messagebox.showerror("Save failed", "Saving this image as %s needs %d MB, more than the memory budget allows. "
+                                             "Save it as PNG, which is written in bands, or raise the budget."
+                                             % (os.path.splitext(file_path)[1] or "this format", math.ceil(nbytes / memory_budget.MB)))
+                        return
+                    self.memory.set("export", nbytes)
+                try:
+                    self.renderer.save(file_path, self.img, self.get_records(full_resolution=False), band_height)
+                except (OSError, ValueError) as e:
+                    # The renderer only replaces file_path once the file is complete, so nothing is left half written
+                    messagebox.showerror("Save failed", str(e))
+                    return
+                finally:
+                    self.memory.release("export")
+                messagebox.showinfo("Success", "Image saved successfully!", icon=messagebox.INFO)
 
     def annotate_image(self, event):
         x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
@@ -475,12 +729,7 @@ class ImageAnnotationApp:
 
     def update_image_zoom(self):
         if self.img:
-            new_width = int(self.img.width * self.zoom_level)
-            new_height = int(self.img.height * self.zoom_level)
-            resized_img = self.img.resize((new_width, new_height), Image.LANCZOS)
-            self.img_tk = ImageTk.PhotoImage(resized_img)
-            self.canvas.delete(self.image_id)
-            self.image_id = self.canvas.create_image(self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2, anchor=tk.CENTER, image=self.img_tk)
+            self.render_photo()
             for annotation in self.annotations:
                 cx, cy = self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2
                 self.canvas.delete(annotation.arrow)
@@ -498,12 +747,74 @@ class ImageAnnotationApp:
         self.canvas.scan_mark(event.x, event.y)
 
     def continue_pan(self, event):
+        if self.select_box_id:
+            # Shift was let go during a rubber-band drag; keep sizing the box instead of panning
+            self.drag_select_box(event)
+            return
         # Adjust the position of the canvas content using scan_dragto
         self.canvas.scan_dragto(event.x, event.y, gain=1)
 
     def check_click_or_drag(self, event):
+        if self.select_box_id:
+            # Shift was let go during a rubber-band drag
+            self.end_select_box(event)
+            return
         if abs(event.x - self.drag_data2["x"]) < 5 and abs(event.y - self.drag_data2["y"]) < 5:
             self.annotate_image(event)
+        elif self.photo_region is not None:
+            # Only the visible part of the zoomed image exists, so fill in what the pan uncovered
+            self.render_photo()
+
+    def start_select_box(self, event):
+        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        self.select_box_start = (x, y)
+        self.select_box_id = self.canvas.create_rectangle(x, y, x, y, outline="#FFFFFF", dash=(4, 2))
+
+    def drag_select_box(self, event):
+        if self.select_box_id:
+            self.canvas.coords(self.select_box_id, *self.select_box_start,
+                               self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+
+    def end_select_box(self, event):
+        if not self.select_box_id:
+            # Shift was pressed after the button went down, so this was a plain click or pan
+            self.check_click_or_drag(event)
+            return
+        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        x0, y0 = self.select_box_start
+        self.canvas.delete(self.select_box_id)
+        self.select_box_id = None
+        if abs(x - x0) < 5 and abs(y - y0) < 5:
+            for ann in self.annotations:
+                if ann.is_clicked(x, y):
+                    if ann.selected:
+                        ann.deselect()
+                    else:
+                        ann.select()
+                    return
+            return
+        # Add every annotation whose label or arrow touches the box
+        items = set(self.canvas.find_overlapping(x0, y0, x, y))
+        for ann in self.annotations:
+            if items.intersection((ann.rect_id, ann.text_id, ann.arrow)):
+                ann.select()
+
+    def style_selection(self):
+        selected = [ann for ann in self.annotations if ann.selected]
+        if not selected:
+            messagebox.showinfo("Style", "Select annotations with shift-click or shift-drag first.")
+            return
+        self.open_settings(selected)
+
+    def open_settings(self, annotations):
+        self.close_settings()
+        self.settings_window = AnnotationSettings(self, annotations)
+
+    def close_settings(self):
+        """Close an open settings window, dropping its unapplied preview."""
+        if self.settings_window is not None and self.settings_window.winfo_exists():
+            self.settings_window.cancel()
+        self.settings_window = None
 
     def undo(self):
         if self.undo_stack:
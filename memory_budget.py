@@ -0,0 +1,85 @@
+import os
+
+MB = 1024 * 1024
+DEFAULT_BUDGET_MB = 2048
+
+
+def default_budget():
+    """Budget in bytes from ANNOTATION_MEMORY_MB, falling back to DEFAULT_BUDGET_MB."""
+    try:
+        return int(os.environ.get("ANNOTATION_MEMORY_MB", DEFAULT_BUDGET_MB)) * MB
+    except ValueError:
+        return DEFAULT_BUDGET_MB * MB
+
+
+class MemoryBudget:
+    """Central account of the large buffers the app keeps alive.
+
+    Buffers are registered by name with a size in bytes (or a function returning
+    the current size, for caches). Entries given an evict callback can be freed
+    when a new allocation would exceed the budget; they are evicted oldest first.
+    """
+
+    def __init__(self, budget_bytes=None, on_change=None):
+        self.budget = budget_bytes if budget_bytes is not None else default_budget()
+        self.on_change = on_change
+        self._entries = {}  # name -> (size or size function, evict callback)
+
+    def set(self, name, nbytes, evict=None):
+        self._entries.pop(name, None)
+        self._entries[name] = (nbytes, evict)
+        self._changed()
+
+    def track(self, name, size_fn, evict=None):
+        """Register something whose size changes over time, such as a cache."""
+        self.set(name, size_fn, evict)
+
+    def release(self, name):
+        if self._entries.pop(name, None) is not None:
+            self._changed()
+
+    def size_of(self, name):
+        nbytes = self._entries.get(name, (0, None))[0]
+        return nbytes() if callable(nbytes) else nbytes
+
+    def used(self):
+        return sum(self.size_of(name) for name in self._entries)
+
+    def available(self):
+        return max(self.budget - self.used(), 0)
+
+    def reserve(self, nbytes, replacing=None):
+        """Make room for nbytes, evicting what we can. Returns True if it fits.
+
+        replacing names an entry (or a tuple of entries) the new allocation will
+        take over from, so their current size is not counted against the request.
+        """
+        replacing = (replacing,) if isinstance(replacing, str) else tuple(replacing or ())
+        needed = nbytes - sum(self.size_of(name) for name in replacing)
+        if self.used() + needed <= self.budget:
+            return True
+        for name, (_, evict) in list(self._entries.items()):
+            if evict is None or name in replacing or self.size_of(name) == 0:
+                continue
+            evict()
+            # Caches stay registered (their size function now reports less); fixed buffers are gone
+            entry = self._entries.get(name)
+            if entry and not callable(entry[0]):
+                del self._entries[name]
+            if self.used() + needed <= self.budget:
+                break
+        self._changed()
+        return self.used() + needed <= self.budget
+
+    def set_budget(self, budget_bytes):
+        """Change the budget and immediately evict whatever no longer fits."""
+        self.budget = budget_bytes
+        self.reserve(0)
+        self._changed()
+
+    def usage_text(self):
+        return "Memory: %d / %d MB" % (round(self.used() / MB), round(self.budget / MB))
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(self)
@@ -0,0 +1,157 @@
+"""Local HTTP service that renders annotated images on request.
+
+POST /render with a JSON body:
+    {"image": "/path/to/image.jpg",
+     "annotations": [{"text": ..., "x": ..., "y": ..., "end_x": ..., "end_y": ..., ...}],
+     "width": 800, "height": 600, "format": "png"}
+Annotations use the records of annotation_formats (image pixel coordinates);
+missing style keys fall back to the app defaults, and size/arrow_th are clamped
+to MAX_SIZE/MAX_ARROW_TH. The response body is the image.
+
+GET /health returns cache statistics.
+"""
+import argparse
+import io
+import ipaddress
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import annotation_formats
+from annotation_render import Renderer
+
+FORMATS = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg"), "jpg": ("JPEG", "image/jpeg")}
+# Canvas font sizes are points; at Tk's usual 96 dpi a point is 96/72 pixels
+DEFAULT_FONT_SCALE = 96 / 72
+# Limits on client-controlled values so one request can't allocate huge labels or outputs
+MAX_SIZE = 400
+MAX_ARROW_TH = 200
+MAX_OUTPUT_SIDE = 16384
+
+
+def parse_request(request):
+    """Validate a /render body and return (image path, records, width, height, format)."""
+    if not isinstance(request, dict):
+        raise ValueError("Request body must be a JSON object")
+    fmt = request.get("format", "png")
+    if not isinstance(fmt, str) or fmt.lower() not in FORMATS:
+        raise ValueError("format must be one of %s" % ", ".join(sorted(FORMATS)))
+    image = request.get("image")
+    if not isinstance(image, str):
+        raise ValueError("image must be a file path")
+    annotations = request.get("annotations", [])
+    if not isinstance(annotations, list) or not all(isinstance(ann, dict) for ann in annotations):
+        raise ValueError("annotations must be a list of objects")
+    records = []
+    for ann in annotations:
+        record = annotation_formats.make_record(**ann)
+        record["size"] = min(max(int(record["size"]), 1), MAX_SIZE)
+        record["arrow_th"] = min(max(int(record["arrow_th"]), 1), MAX_ARROW_TH)
+        records.append(record)
+    sizes = []
+    for key in ("width", "height"):
+        value = request.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)
+                                  or not 0 < value <= MAX_OUTPUT_SIDE):
+            raise ValueError("%s must be an integer between 1 and %d" % (key, MAX_OUTPUT_SIDE))
+        sizes.append(value)
+    return image, records, sizes[0], sizes[1], fmt.lower()
+
+
+def is_loopback(host):
+    try:
+        return all(ipaddress.ip_address(info[4][0]).is_loopback
+                   for info in socket.getaddrinfo(host, None))
+    except (socket.gaierror, ValueError):
+        return False
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_error(404)
+            return
+        renderer = self.server.renderer
+        stats = {"images": renderer.images.stats(), "fonts": renderer.fonts.stats(),
+                 "sprites": renderer.sprites.stats()}
+        self.send_body(json.dumps(stats).encode("utf-8"), "application/json")
+
+    def do_POST(self):
+        if self.path != "/render":
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            image, records, width, height, fmt = parse_request(request)
+            fmt, content_type = FORMATS[fmt]
+            img = self.server.renderer.render(image, records, width, height)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.send_error(400, explain=str(e))
+            return
+        out = io.BytesIO()
+        img.save(out, fmt)
+        self.send_body(out.getvalue(), content_type)
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class RenderServer(HTTPServer):
+    """HTTPServer that hands each connection to a fixed pool of worker threads."""
+
+    def __init__(self, address=("127.0.0.1", 8765), renderer=None, workers=4, quiet=False):
+        if not is_loopback(address[0]):
+            raise ValueError("Render service only listens on localhost, not %r" % address[0])
+        self.renderer = renderer or Renderer(font_scale=DEFAULT_FONT_SCALE)
+        self.quiet = quiet
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        super().__init__(address, RenderRequestHandler)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render annotated images over HTTP on localhost.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--image-cache-mb", type=int, default=512)
+    parser.add_argument("--font-scale", type=float, default=DEFAULT_FONT_SCALE,
+                        help="pixels per font size unit; match the app's Tk scaling (default 96/72)")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    renderer = Renderer(image_cache_bytes=args.image_cache_mb * 1024 * 1024, font_scale=args.font_scale)
+    server = RenderServer((args.host, args.port), renderer, args.workers, args.quiet)
+    print("Rendering on http://%s:%d/render" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import io
+import json
+
+import pytest
+
+import annotation_formats as af
+
+
+def coco_data():
+    return {
+        "info": {"description": "chién ☃", "version": 1.5},
+        "images": [{"id": i, "file_name": "imgs/img%d.jpg" % i, "width": 100, "height": 80} for i in (1, 2, 3)],
+        "annotations": [
+            {"id": 1, "image_id": 1, "category_id": 7, "bbox": [10, 20, 30, 40], "segmentation": [[1.5] * 20]},
+            {"id": 2, "image_id": 2, "category_id": 7, "bbox": [0, 0, 4, 6]},
+            {"id": 3, "image_id": 1, "category_id": 8, "bbox": [50, 50, 10, 10]},
+            {"id": 4, "image_id": 1, "category_id": 8},
+        ],
+        "categories": [{"id": 7, "name": "chién"}, {"id": 8, "name": "☃ snowman"}],
+        "empty": [],
+        "count": 1234567,
+    }
+
+
+@pytest.fixture
+def coco_path(tmp_path):
+    path = tmp_path / "coco.json"
+    path.write_text(json.dumps(coco_data(), ensure_ascii=False, indent=1), encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_iter_json_arrays_spans_match_bytes(coco_path, chunk_size):
+    with open(coco_path, "rb") as fp:
+        items = list(af.iter_json_arrays(fp, chunk_size))
+    raw = open(coco_path, "rb").read()
+    keys = [key for key, _, _, _ in items]
+    assert keys.count("annotations") == 4
+    assert keys.count("images") == 3
+    assert "empty" not in keys
+    for key, item, start, end in items:
+        assert json.loads(raw[start:end]) == item
+    assert [item for key, item, _, _ in items if key == "count"] == [1234567]
+
+
+@pytest.mark.parametrize("text", ["{}", "{ }", '{"a": []}', '{"a": [ ], "b": {}}'])
+def test_iter_json_arrays_empty(text):
+    items = list(af.iter_json_arrays(io.BytesIO(text.encode()), 1))
+    assert all(key != "a" for key, _, _, _ in items)
+
+
+def test_iter_json_arrays_rejects_non_object():
+    with pytest.raises(ValueError):
+        list(af.iter_json_arrays(io.BytesIO(b"[1, 2]"), 2))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 20])
+def test_coco_dataset_reads_one_image(coco_path, chunk_size):
+    dataset = af.CocoDataset(coco_path, chunk_size=chunk_size)
+    assert "img1.jpg" in dataset and "other.jpg" not in dataset
+    records = dataset.annotations_for("img1.jpg")
+    # The annotation without a bbox is skipped
+    assert [r["text"] for r in records] == ["chién", "☃ snowman"]
+    assert (records[0]["end_x"], records[0]["end_y"]) == (25, 40)
+    assert (records[0]["box_w"], records[0]["box_h"]) == (30, 40)
+    assert dataset.annotations_for("img3.jpg") == []
+
+
+def test_coco_round_trip(coco_path, tmp_path):
+    dataset = af.CocoDataset(coco_path)
+    out = str(tmp_path / "out.json")
+    af.write_coco(out, dataset.iter_images())
+    json.load(open(out, encoding="utf-8"))
+    again = af.CocoDataset(out, chunk_size=3)
+    for file_name in dataset.images:
+        assert again.annotations_for(file_name) == dataset.annotations_for(file_name)
+
+
+def test_voc_round_trip(coco_path, tmp_path):
+    dataset = af.CocoDataset(coco_path)
+    af.write_voc_dir(str(tmp_path), dataset.iter_images())
+    # Unrelated or broken XML files in the folder are skipped
+    (tmp_path / "broken.xml").write_text("<annotation><filename>", encoding="utf-8")
+    voc = af.VocDataset(str(tmp_path))
+    assert sorted(voc.images) == ["img1.jpg", "img2.jpg", "img3.jpg"]
+    for expected, got in zip(dataset.annotations_for("img1.jpg"), voc.annotations_for("img1.jpg")):
+        assert got["text"] == expected["text"]
+        assert got["end_x"] == pytest.approx(expected["end_x"])
+        assert got["box_w"] == pytest.approx(expected["box_w"])
+    assert next(voc.iter_images())[1:3] == (100, 80)
+
+
+def test_voc_object_without_bndbox_is_skipped(tmp_path):
+    (tmp_path / "a.xml").write_text(
+        "<annotation><filename>a.jpg</filename>"
+        "<object><name>no box</name></object>"
+        "<object><name>ok</name><bndbox><xmin>0</xmin><ymin>0</ymin><xmax>4</xmax><ymax>2</ymax></bndbox></object>"
+        "</annotation>", encoding="utf-8")
+    records = af.VocDataset(str(tmp_path)).annotations_for("a.jpg")
+    assert [(r["text"], r["end_x"], r["end_y"]) for r in records] == [("ok", 2, 1)]
+
+
+@pytest.mark.parametrize("size", ["", "<size><width>500.0</width></size>", "<size><width>x</width><height>7</height></size>"])
+def test_voc_bad_size_is_none(tmp_path, size):
+    (tmp_path / "a.xml").write_text("<annotation><filename>a.jpg</filename>%s</annotation>" % size, encoding="utf-8")
+    file_name, width, height, _ = next(af.VocDataset(str(tmp_path)).iter_images())
+    assert file_name == "a.jpg"
+    assert width in (None, 500) and height in (None, 7)
+
+
+def test_export_coco_onto_imported_file(coco_path):
+    dataset = af.CocoDataset(coco_path)
+    expected = {file_name: dataset.annotations_for(file_name) for file_name in dataset.images}
+    af.write_coco(coco_path, dataset.iter_images())
+    again = af.CocoDataset(coco_path)
+    assert {file_name: again.annotations_for(file_name) for file_name in again.images} == expected
+
+
+def test_failed_write_keeps_old_file(coco_path):
+    before = open(coco_path, "rb").read()
+
+    def images():
+        yield "a.jpg", 1, 1, [af.make_record("a", 0, 0, 0, 0)]
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        af.write_coco(coco_path, images())
+    assert open(coco_path, "rb").read() == before
+    assert len(list(af.os.scandir(af.os.path.dirname(coco_path)))) == 1
+
+
+def test_large_value_is_read_in_linear_time():
+    # 200k chunk refills would take minutes if every refill re-decoded the whole value
+    text = '{"a": [%s]}' % json.dumps({"s": "x" * 200000, "n": list(range(20000))})
+    items = list(af.iter_json_arrays(io.BytesIO(text.encode()), 1))
+    assert len(items[0][1]["n"]) == 20000
+
+
+def test_value_size_cap():
+    text = '{"a": [%s]}' % json.dumps("x" * 1000)
+    with pytest.raises(ValueError, match="larger than"):
+        list(af.iter_json_arrays(io.BytesIO(text.encode()), 16, max_value_size=100))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1 << 20])
+def test_syntax_error_reports_file_offset(chunk_size):
+    text = b'{"images": [{"id": 1}, {"id": 2,, "x": 1}]}'
+    with pytest.raises(ValueError, match="at byte %d:" % (text.index(b",,") + 1)):
+        list(af.iter_json_arrays(io.BytesIO(text), chunk_size))
@@ -0,0 +1,45 @@
+from memory_budget import MemoryBudget
+
+
+def make_budget(budget=1000):
+    changes = []
+    memory = MemoryBudget(budget, on_change=changes.append)
+    cache = {"size": 600}
+    memory.track("cache", lambda: cache["size"], lambda: cache.update(size=0))
+    return memory, cache, changes
+
+
+def test_reserve_fits_without_evicting():
+    memory, cache, _ = make_budget()
+    memory.set("image", 300)
+    assert memory.reserve(100)
+    assert cache["size"] == 600
+
+
+def test_reserve_evicts_caches_but_keeps_them_registered():
+    memory, cache, _ = make_budget()
+    memory.set("image", 300)
+    assert memory.reserve(500)
+    assert cache["size"] == 0
+    cache["size"] = 10
+    assert memory.used() == 310
+
+
+def test_reserve_replacing_counts_old_entries_as_free():
+    memory, cache, _ = make_budget()
+    memory.set("image", 300)
+    memory.set("photo", 100)
+    assert not memory.reserve(1000)
+    cache["size"] = 600
+    assert memory.reserve(500, replacing=("image", "photo"))
+    assert cache["size"] == 0
+
+
+def test_set_budget_evicts_immediately():
+    memory, cache, changes = make_budget()
+    memory.set("image", 300)
+    memory.set_budget(500)
+    assert cache["size"] == 0
+    assert memory.used() == 300
+    assert changes[-1] is memory
+    assert memory.usage_text() == "Memory: 0 / 0 MB"
@@ -0,0 +1,71 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from PIL import Image
+
+from render_service import RenderServer
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / "blank.png"
+    Image.new("RGB", (200, 100), "#202020").save(path)
+    return str(path)
+
+
+@pytest.fixture
+def server():
+    server = RenderServer(("127.0.0.1", 0), workers=2, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, body):
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    return urllib.request.urlopen(urllib.request.Request(url + "/render", data), timeout=10)
+
+
+def test_render_and_health(server, image_path):
+    body = {"image": image_path, "width": 100,
+            "annotations": [{"text": "dog", "x": 10, "y": 50, "end_x": 150, "end_y": 80, "size": 12}]}
+    for _ in range(2):
+        response = post(server, body)
+        assert response.headers["Content-Type"] == "image/png"
+        img = Image.open(io.BytesIO(response.read()))
+        assert img.size == (100, 50)
+    # Something red was drawn on the dark background
+    assert img.getextrema()[0][1] > 200
+    stats = json.load(urllib.request.urlopen(server + "/health", timeout=10))
+    assert stats["images"]["items"] == 1 and stats["images"]["hits"] >= 1
+    assert stats["sprites"]["items"] == 1
+
+
+@pytest.mark.parametrize("body", [
+    b"[1, 2]",
+    b"not json",
+    {"image": "x.png", "format": 5},
+    {"image": "x.png", "format": "gif"},
+    {"image": "/does/not/exist.png"},
+    {"image": "IMAGE", "width": -5},
+    {"image": "IMAGE", "height": 0},
+    {"image": "IMAGE", "annotations": [{"text": "a"}]},
+    {"image": "IMAGE", "annotations": ["a"]},
+])
+def test_bad_requests_get_400(server, image_path, body):
+    if isinstance(body, dict) and body["image"] == "IMAGE":
+        body = dict(body, image=image_path)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        post(server, body)
+    assert error.value.code == 400
+
+
+def test_refuses_non_loopback():
+    with pytest.raises(ValueError):
+        RenderServer(("0.0.0.0", 0))